@@ -0,0 +1,151 @@
+import json
+import os
+import posixpath
+from functools import lru_cache
+from hashlib import blake2b
+from pathlib import Path
+from west.util import west_topdir, WestNotFound
+
+# Cross-process cache of workspace root lookups, keyed by (cwd, ZEPHYR_BASE)
+CACHE_FILE = Path.home() / '.cache' / 'multipass-zephyr' / 'paths.json'
+
+
+def _build_hash(path):
+    """Short stable tag for a host path, used to name VM build dirs and mounts."""
+    return blake2b(path.encode(), digest_size=4).hexdigest()
+
+
+def _plan_vm_paths(host_paths, workspace_root, vm_root):
+    """Map host paths into the VM.
+
+    Paths under workspace_root map below vm_root by a plain prefix test;
+    anything else lives under an /mnt/ext_<hash> mount point (of the parent
+    directory for files). External paths nested inside another external path
+    share its mount rather than getting an overlapping one. Returns
+    (mapping, mounts) where mounts is {host_path: vm_mount_point}.
+    """
+    root_parts = Path(workspace_root).parts
+    n = len(root_parts)
+    mapping, external = {}, []
+    for host_path in host_paths:
+        parts = Path(_resolve(host_path)).parts
+        if parts[:n] == root_parts:
+            mapping[host_path] = posixpath.join(vm_root, *parts[n:])
+        else:
+            # Mounts must be directories: mount the parent of external files
+            mount_parts = parts[:-1] if os.path.isfile(host_path) else parts
+            external.append((host_path, parts, mount_parts))
+
+    # Outermost directories first, so nested ones find their ancestor's mount
+    mount_roots = []
+    for _, _, mount_parts in sorted(external, key=lambda e: len(e[2])):
+        if not any(mount_parts[:len(r)] == r for r in mount_roots):
+            mount_roots.append(mount_parts)
+
+    mounts = {}
+    for host_path, parts, _ in external:
+        root = next(r for r in mount_roots if parts[:len(r)] == r)
+        root_path = os.fspath(Path(*root))
+        mount_point = mounts.setdefault(root_path, f"/mnt/ext_{_build_hash(root_path)}")
+        mapping[host_path] = posixpath.join(mount_point, *parts[len(root):])
+    return mapping, mounts
+
+
+def find_source_dir(args, search_roots=('',)):
+    """Split the first non-option arg naming a directory off args.
+
+    Relative args are tried against each of search_roots in order ('' being
+    the cwd). Returns (source_dir or None, remaining args).
+    """
+    for i, arg in enumerate(args):
+        if arg.startswith('-'):
+            continue
+        for root in search_roots:
+            path = os.path.join(root, arg)
+            if os.path.isdir(path):
+                return path, args[:i] + args[i + 1:]
+    return None, list(args)
+
+
+def _split_arg_path(arg):
+    """Split 'KEY=/abs/path' or '/abs/path' into (prefix, path); path is None otherwise."""
+    prefix, sep, value = arg.partition('=')
+    if not sep:
+        prefix, value = '', arg
+    else:
+        prefix += sep
+    if os.path.isabs(value) and os.path.exists(value):
+        return prefix, value
+    return arg, None
+
+
+def _arg_paths(args):
+    """Existing absolute host paths referenced by args, bare or as KEY=value."""
+    return [path for _, path in map(_split_arg_path, args) if path]
+
+
+def _rewrite_arg_paths(args, mapping):
+    """Replace host paths found by _arg_paths() with their VM paths."""
+    rewritten = []
+    for arg in args:
+        prefix, path = _split_arg_path(arg)
+        rewritten.append(prefix + mapping[path] if path in mapping else arg)
+    return rewritten
+
+
+@lru_cache(maxsize=None)
+def _resolve(p):
+    """Resolve a host path once per process."""
+    return os.fspath(Path(p).resolve())
+
+
+def _west_config_stamp(topdir):
+    try:
+        return os.stat(os.path.join(topdir, '.west', 'config')).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _store_cache(cache):
+    try:
+        CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = CACHE_FILE.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, CACHE_FILE)
+    except OSError:
+        pass  # Best effort: the cache only saves a directory walk
+
+
+@lru_cache(maxsize=None)
+def _topdir(cwd, zephyr_base):
+    """Resolved west workspace root for cwd, falling back to ZEPHYR_BASE's parent.
+
+    Results are also persisted in CACHE_FILE, stamped with the mtime of
+    .west/config, so later invocations skip the upward directory walk.
+    """
+    key = f"{cwd}|{zephyr_base}"
+    cache = _load_cache()
+    entry = cache.get(key)
+    if entry and entry.get('stamp') is not None and _west_config_stamp(entry['topdir']) == entry['stamp']:
+        return entry['topdir']
+
+    try:
+        workspace_root = _resolve(west_topdir(cwd))
+    except WestNotFound:
+        # Not persisted: proving there is still no .west needs the walk anyway
+        return _resolve(os.path.dirname(zephyr_base))
+
+    stamp = _west_config_stamp(workspace_root)
+    if stamp is not None:
+        cache[key] = {'topdir': workspace_root, 'stamp': stamp}
+        _store_cache(cache)
+    return workspace_root
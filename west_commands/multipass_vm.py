@@ -1,14 +1,32 @@
 import subprocess
 import os
 import json
+import posixpath
+import shlex
 import sys
-import shutil
-import platform
-import multiprocessing
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from west import log
 
 class MultipassVM:
+    # multipass subcommands that invalidate cached list/info output
+    _STATE_CHANGING = ('launch', 'start', 'stop', 'set', 'mount', 'unmount')
+
+    # Workspace paths never copied to VM-local storage (see also sync_excludes)
+    RSYNC_EXCLUDES = ('.git/', '/build/', '/builds/', '/twister-out*/', '__pycache__/', '*.pyc', '*.o', '/.cache/')
+    # rsync exclude rules are written to RSYNC_FILTERS-<hash of the rules>
+    RSYNC_FILTERS = '/home/ubuntu/.cache/rsync-filters'
+    # Seconds without a heartbeat after which a 'west vsync' watcher counts as dead
+    VSYNC_HEARTBEAT_TIMEOUT = 10
+    # Resolved Python requirement locks (host-backed, see _ensure_caches)
+    LOCK_CACHE_DIR = '/home/ubuntu/.cache/zephyr-locks'
+    # Fingerprint of the last successful zephyr-export + requirements install
+    BOOTSTRAP_STAMP = '/home/ubuntu/.bootstrap.sha'
+
     def __init__(self, vm_name='zephyr-vm'):
         self.vm_name = vm_name
         self.ubuntu_version = '24.04'
@@ -16,9 +34,42 @@ class MultipassVM:
         self.default_memory = '4G'
         self.disk = '20G'
 
-    def _run_cmd(self, cmd, capture_output=True, check=True):
+        # Short-lived caches of 'multipass list' / 'multipass info' output,
+        # dropped whenever a state-changing multipass command runs
+        self._cache_ttl = 5.0
+        self._status_cache = None
+        self._status_cache_ts = 0
+        self._info_cache = None
+        self._info_cache_ts = 0
+        self._resources_cache = None
+        self._vm_index = {}
+        self._host_resources = None
+        self._has_zeth = None
+        self._known_mounts = {}  # vm_path -> resolved host source verified by mount()
+
+        # Explicitly define paths and variables to avoid bashrc sourcing issues
+        # Prioritize venv if it exists
+        paths = "export PATH=/home/ubuntu/.venv/bin:$PATH:$HOME/.local/bin"
+        envs = "export ZEPHYR_TOOLCHAIN_VARIANT=zephyr && export ZEPHYR_SDK_INSTALL_DIR=/home/ubuntu/zephyr-sdk && export PIP_BREAK_SYSTEM_PACKAGES=1"
+        # uv cache lives on a host mount; hardlinks cannot cross into the venv
+        envs += " && export UV_CACHE_DIR=/home/ubuntu/.cache/uv && export UV_LINK_MODE=copy"
+        self._env_prefix_str = f"{paths} && {envs}"
+
+        # argv variant for 'env KEY=VAL ...': no shell expansion happens there,
+        # so PATH spells out the Ubuntu default
+        env_kv = [
+            ('PATH', '/home/ubuntu/.venv/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:/snap/bin:/home/ubuntu/.local/bin'),
+            ('ZEPHYR_TOOLCHAIN_VARIANT', 'zephyr'),
+            ('ZEPHYR_SDK_INSTALL_DIR', '/home/ubuntu/zephyr-sdk'),
+            ('PIP_BREAK_SYSTEM_PACKAGES', '1'),
+            ('UV_CACHE_DIR', '/home/ubuntu/.cache/uv'),
+            ('UV_LINK_MODE', 'copy'),
+        ]
+        self._env_argv = ('env',) + tuple(f"{key}={value}" for key, value in env_kv)
+
+    def _run_cmd(self, cmd, capture_output=True, check=True, input=None):
         try:
-            result = subprocess.run(cmd, capture_output=capture_output, text=True, check=check)
+            result = subprocess.run(cmd, capture_output=capture_output, text=True, check=check, input=input)
             return result
         except subprocess.CalledProcessError as e:
             if check:
@@ -27,52 +78,82 @@ class MultipassVM:
                 print(f"Stderr: {e.stderr}")
                 raise
             return e
+        finally:
+            if cmd[:1] == ['multipass'] and len(cmd) > 1 and cmd[1] in self._STATE_CHANGING:
+                self._invalidate_cache()
+
+    def _invalidate_cache(self):
+        self._status_cache = None
+        self._info_cache = None
+        self._resources_cache = None
 
     def get_status(self):
+        if self._status_cache is not None and time.monotonic() - self._status_cache_ts < self._cache_ttl:
+            return self._status_cache
+
         result = self._run_cmd(['multipass', 'list', '--format', 'json'])
-        vms = json.loads(result.stdout).get('list', [])
-        for vm in vms:
-            if vm['name'] == self.vm_name:
-                return vm['state'].lower()
-        return 'not-found'
+        self._vm_index = {vm['name']: vm for vm in json.loads(result.stdout).get('list', [])}
+        status = self._vm_index.get(self.vm_name, {}).get('state', 'not-found').lower()
+
+        self._status_cache, self._status_cache_ts = status, time.monotonic()
+        return status
+
+    def _get_info(self):
+        """Return this VM's 'multipass info' entry, cached like get_status()."""
+        if self._info_cache is not None and time.monotonic() - self._info_cache_ts < self._cache_ttl:
+            return self._info_cache
+
+        result = self._run_cmd(['multipass', 'info', self.vm_name, '--format', 'json'])
+        info = json.loads(result.stdout).get('info', {}).get(self.vm_name, {})
+        self._info_cache, self._info_cache_ts = info, time.monotonic()
+        return info
 
     def _get_env_setup(self):
-        # Explicitly define paths and variables to avoid bashrc sourcing issues
-        # Prioritize venv if it exists
-        paths = "export PATH=/home/ubuntu/.venv/bin:$PATH:$HOME/.local/bin"
-        envs = "export ZEPHYR_TOOLCHAIN_VARIANT=zephyr && export ZEPHYR_SDK_INSTALL_DIR=/home/ubuntu/zephyr-sdk && export PIP_BREAK_SYSTEM_PACKAGES=1"
-        return f"{paths} && {envs}"
+        return self._env_prefix_str
+
+    def _get_env_argv(self):
+        # Same environment as _get_env_setup() for 'env KEY=VAL ...'
+        return list(self._env_argv)
 
-    def _is_setup(self):
+    @staticmethod
+    def _needs_shell(cmd):
+        """Whether cmd uses shell syntax (operators, expansion, builtins)."""
+        if any(c in cmd for c in '&|;$<>`*?~(){}[]#\n\\'):
+            return True
+        try:
+            words = shlex.split(cmd)
+        except ValueError:
+            return True
+        return not words or '=' in words[0] or words[0] in ('cd', 'export', 'source', '.', 'set', 'exec')
+
+    def _missing_components(self):
+        """Probe tools, venv and SDK in one VM round-trip; an empty list means ready."""
         print("  [VM] Checking dependencies...")
         env = self._get_env_setup()
-        
-        # Check tools
-        for cmd in ["west", "cmake", "ninja", "brctl", "uv"]:
-            check_cmd = f"multipass exec {self.vm_name} -- bash -c '{env} && which {cmd}'"
-            res = subprocess.run(check_cmd, shell=True, capture_output=True)
-            if res.returncode != 0:
-                print(f"  [VM] Component '{cmd}' not found. Setup required.")
-                return False
-        
-        # Check venv
-        print("  [VM] Checking for virtual environment...")
-        venv_check = f"multipass exec {self.vm_name} -- bash -c 'test -d /home/ubuntu/.venv'"
-        res = subprocess.run(venv_check, shell=True, capture_output=True)
-        if res.returncode != 0:
-            print("  [VM] Virtual environment not found. Setup required.")
-            return False
-        
-        # Check SDK
-        print("  [VM] Checking for Zephyr SDK...")
-        sdk_check = f"multipass exec {self.vm_name} -- bash -c 'ls -d /home/ubuntu/zephyr-sdk'"
-        res = subprocess.run(sdk_check, shell=True, capture_output=True)
-        if res.returncode != 0:
-            print("  [VM] Zephyr SDK not found at /home/ubuntu/zephyr-sdk. Setup required.")
-            return False
 
-        print("  [VM] Dependencies and SDK verified.")
-        return True
+        probe = (
+            f"{env}; "
+            'for c in west cmake ninja brctl uv; do command -v "$c" >/dev/null || echo "MISS:$c"; done; '
+            "[ -d /home/ubuntu/.venv ] || echo MISS:venv; "
+            "[ -d /home/ubuntu/zephyr-sdk ] || echo MISS:sdk; "
+            "ip link show zeth >/dev/null 2>&1 && echo HAS:zeth; "
+            "echo DONE"
+        )
+        res = self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'bash', '-c', probe], check=False)
+        lines = res.stdout.splitlines() if res.stdout else []
+        if 'DONE' not in lines:
+            print("  [VM] Dependency probe failed. Setup required.")
+            return ['probe']
+
+        # Piggyback the TAP interface check for setup_native_sim_network
+        self._has_zeth = 'HAS:zeth' in lines
+
+        missing = [line[5:] for line in lines if line.startswith('MISS:')]
+        if missing:
+            print(f"  [VM] Components not found: {', '.join(missing)}. Setup required.")
+        else:
+            print("  [VM] Dependencies and SDK verified.")
+        return missing
 
     def ensure_vm(self, zephyr_base_path=None, cpus=None, memory=None):
         status = self.get_status()
@@ -83,29 +164,72 @@ class MultipassVM:
             print(f"Creating Multipass VM '{self.vm_name}'...")
             self._run_cmd(['multipass', 'launch', '24.04', '--name', self.vm_name, 
                            '--cpus', str(target_cpus), '--memory', target_mem, '--disk', self.disk])
+            # A fresh VM has no local workspace copy for 'west vsync' deltas to apply to
+            (self.state_dir() / 'synced.json').unlink(missing_ok=True)
+            self._ensure_caches()
             self._setup_vm(zephyr_base_path)
         elif status == 'stopped':
             print(f"Starting Multipass VM '{self.vm_name}'...")
             self._run_cmd(['multipass', 'start', self.vm_name])
-            if not self._is_setup():
+            self._ensure_caches()
+            if self._missing_components():
                 self._setup_vm(zephyr_base_path)
         elif status == 'running':
-            if not self._is_setup():
+            # Cache mounts were made on launch/start and persist while it runs
+            if self._missing_components():
+                self._ensure_caches()
                 self._setup_vm(zephyr_base_path)
             else:
                 print("VM is ready.")
 
+    def _ensure_caches(self):
+        """Mount host-side uv and lock directories so they survive VM recreation.
+
+        ccache stays VM-local: every compile's lookups and lock files would
+        otherwise go over sshfs.
+        """
+        if '/home/ubuntu/.ccache' in self._get_info().get('mounts', {}):
+            # Left behind by earlier versions that shared ccache with the host
+            self._run_cmd(['multipass', 'unmount', f"{self.vm_name}:/home/ubuntu/.ccache"], check=False)
+        host_cache_root = Path.home() / '.cache' / 'multipass-zephyr'
+        caches = (
+            ('uv-cache', '/home/ubuntu/.cache/uv'),
+            ('locks', self.LOCK_CACHE_DIR),
+        )
+        mounts = {}
+        for name, vm_path in caches:
+            host_dir = host_cache_root / name
+            host_dir.mkdir(parents=True, exist_ok=True)
+            mounts[str(host_dir)] = vm_path
+        self.mount_all(mounts)
+
     def get_host_resources(self):
         """Detect host resources safely for cross-platform support."""
+        if self._host_resources is not None:
+            return self._host_resources
+
+        import multiprocessing
+        import platform
+
+        try:
+            import psutil
+        except ImportError:
+            psutil = None
+
         # CPUs
-        total_cpus = multiprocessing.cpu_count()
+        if psutil:
+            total_cpus = psutil.cpu_count(logical=True) or multiprocessing.cpu_count()
+        else:
+            total_cpus = multiprocessing.cpu_count()
         safe_cpus = max(2, total_cpus - 2)
         
         # Memory (Bytes)
         total_mem_bytes = 0
         sys_pf = platform.system()
         try:
-            if sys_pf == "Darwin":
+            if psutil:
+                total_mem_bytes = psutil.virtual_memory().total
+            elif sys_pf == "Darwin":
                 res = subprocess.run(["sysctl", "-n", "hw.memsize"], capture_output=True, text=True)
                 total_mem_bytes = int(res.stdout.strip())
             elif sys_pf == "Windows":
@@ -127,14 +251,18 @@ class MultipassVM:
         limit_mem_bytes = min(int(total_mem_bytes * 0.75), total_mem_bytes - (4 * 1024 * 1024 * 1024))
         safe_memory_gb = max(4, int(limit_mem_bytes / (1024 * 1024 * 1024)))
         
-        return safe_cpus, f"{safe_memory_gb}G"
+        self._host_resources = (safe_cpus, f"{safe_memory_gb}G")
+        return self._host_resources
 
     def get_current_resources(self):
-        """Get current VM CPU and Memory settings."""
+        """Get current VM CPU and Memory settings (cached until the next state change)."""
+        if self._resources_cache is not None:
+            return self._resources_cache
         try:
             cpus_res = self._run_cmd(['multipass', 'get', f'local.{self.vm_name}.cpus'])
             mem_res = self._run_cmd(['multipass', 'get', f'local.{self.vm_name}.memory'])
-            return int(cpus_res.stdout.strip()), mem_res.stdout.strip()
+            self._resources_cache = int(cpus_res.stdout.strip()), mem_res.stdout.strip()
+            return self._resources_cache
         except:
             return None, None
 
@@ -169,14 +297,71 @@ class MultipassVM:
         else:
             print(f"Already using '{profile}' resource profile.")
 
+    def has_resources(self, profile):
+        """Whether the VM already runs with the given resource profile."""
+        if profile == 'high':
+            target = self.get_host_resources()
+        else:
+            target = (self.default_cpus, self.default_memory)
+        return self.get_current_resources() == target
+
+    @contextmanager
+    def activity(self):
+        """Mark this process as using the VM, so a deferred scale-down waits for it.
+
+        The marker is named after the PID; a command that replaces itself via
+        exec keeps it valid until the replacing process exits.
+        """
+        active_dir = self.state_dir() / 'active'
+        active_dir.mkdir(parents=True, exist_ok=True)
+        marker = active_dir / str(os.getpid())
+        marker.touch()
+        self.update_state(last_activity_ts=time.time())
+        try:
+            yield
+        finally:
+            self.update_state(last_activity_ts=time.time())
+            marker.unlink(missing_ok=True)
+
+    def in_use(self):
+        """Whether any live process holds an activity() marker for this VM."""
+        try:
+            markers = list((self.state_dir() / 'active').iterdir())
+        except OSError:
+            return False
+        busy = False
+        for marker in markers:
+            if marker.name.isdigit() and _pid_alive(int(marker.name)):
+                busy = True
+            else:
+                marker.unlink(missing_ok=True)  # Left behind by a crashed command
+        return busy
+
+    def schedule_scale_down(self, delay):
+        """Scale down to the 'low' profile once the VM has been idle for delay seconds.
+
+        Runs in a detached Python process so the west command can exit now.
+        Scheduling again, or cancel_scale_down(), supersedes a pending one.
+        """
+        print(f"VM will scale down after {int(delay)}s of inactivity.")
+        token = uuid.uuid4().hex
+        self.update_state(scale_down_token=token)
+        kwargs = {}
+        if os.name == 'nt':
+            kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--scale-down', self.vm_name, repr(delay), token],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs
+        )
+
+    def cancel_scale_down(self):
+        self.update_state(scale_down_token=None)
+
     def _setup_vm(self, zephyr_base_path=None):
         print("Setting up VM dependencies and Zephyr SDK...")
 
-        # BUG: On Ubuntu 24.04, Multipass mount helper can fail after resource restarts.
-        # Installing multipass-sshfs manually is the official workaround.
-        print("  [VM] Installing mount helpers (Multipass bug workaround)...")
-        self.exec_shell("sudo apt update && sudo apt install -y sshfs snapd && sudo snap install multipass-sshfs", check=False)
-
         # Detect SDK version from host workspace if available
         sdk_version = "0.17.0"  # Default fallback
         if zephyr_base_path:
@@ -189,8 +374,34 @@ class MultipassVM:
                 except Exception as e:
                     print(f"Warning: Could not read SDK_VERSION file at {sdk_version_file}: {e}")
                     print(f"Using default SDK version: {sdk_version}")
-        
-        # 1. Install packages from user's verified list
+
+        # apt, SDK download and uv install are independent: run them as
+        # concurrent multipass exec sessions, then finish the dependent steps.
+        with ThreadPoolExecutor(max_workers=3) as ex:
+            futures = [
+                ex.submit(self._stage_apt),
+                ex.submit(self._stage_sdk, sdk_version),
+                ex.submit(self._stage_uv_venv),
+            ]
+            for future in futures:
+                future.result()
+
+        self._stage_west_env()
+
+    def _stage_apt(self):
+        # Keep downloaded .debs in a host-backed archive so VM recreation skips the downloads
+        host_archives = Path.home() / '.cache' / 'multipass-zephyr' / 'apt-archives'
+        host_archives.mkdir(parents=True, exist_ok=True)
+        self.mount(str(host_archives), '/var/cache/apt/archives')
+        keep_debs = 'Binary::apt::APT::Keep-Downloaded-Packages "true";'
+        self.exec_shell(f"echo '{keep_debs}' | sudo tee /etc/apt/apt.conf.d/01keep-debs >/dev/null")
+
+        # BUG: On Ubuntu 24.04, Multipass mount helper can fail after resource restarts.
+        # Installing multipass-sshfs manually is the official workaround.
+        print("  [VM] Installing mount helpers (Multipass bug workaround)...")
+        self.exec_shell("sudo apt update && sudo apt install -y sshfs snapd && sudo snap install multipass-sshfs", check=False)
+
+        # Install packages from user's verified list
         packages = [
             "git", "cmake", "ninja-build", "gperf", "ccache", "device-tree-compiler",
             "wget", "file", "libmagic1", "xz-utils", "python3-dev", "python3-pip",
@@ -200,7 +411,15 @@ class MultipassVM:
         install_cmd = f"sudo apt-get update && sudo apt-get install -y --no-install-recommends {' '.join(packages)}"
         self.exec_shell(install_cmd)
 
-        # 2. Install Zephyr SDK (Architecture-aware)
+    def _stage_sdk(self, sdk_version):
+        # Download and extract the Zephyr SDK (Architecture-aware).
+        # CMake package registration needs cmake from apt and runs in _stage_west_env.
+        host_cache = self._sdk_cache_path(sdk_version)
+        sdk_present = self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'test', '-d', '/home/ubuntu/zephyr-sdk'], check=False).returncode == 0
+        if host_cache.exists() and not sdk_present:
+            print(f"Using cached Zephyr SDK tarball {host_cache}...")
+            self._run_cmd(['multipass', 'transfer', str(host_cache), f"{self.vm_name}:/tmp/sdk.tar.xz"])
+
         sdk_setup = f"""
         set -e
         ARCH=$(uname -m)
@@ -216,9 +435,12 @@ class MultipassVM:
         
         if [ ! -d /home/ubuntu/zephyr-sdk ]; then
             echo "Downloading and installing Zephyr SDK v${{SDK_VERSION}} for ${{ARCH}}..."
-            wget -q --show-progress ${{SDK_URL}} -O /tmp/sdk.tar.xz
+            if [ ! -f /tmp/sdk.tar.xz ]; then
+                wget -q --show-progress ${{SDK_URL}} -O /tmp/sdk.tar.xz
+            fi
             cd /home/ubuntu
-            tar xf /tmp/sdk.tar.xz
+            # Multi-threaded xz decompression (xz-utils ships with the Ubuntu image)
+            tar -I 'xz -T0' -xf /tmp/sdk.tar.xz
             # Correcting the directory name based on extraction results
             if [ -d zephyr-sdk-${{SDK_VERSION}} ]; then
                 mv zephyr-sdk-${{SDK_VERSION}} /home/ubuntu/zephyr-sdk
@@ -226,8 +448,6 @@ class MultipassVM:
                 # Fallback in case the name is different
                 mv zephyr-sdk-${{SDK_VERSION}}_linux-${{ARCH}}_minimal /home/ubuntu/zephyr-sdk
             fi
-            rm /tmp/sdk.tar.xz
-            /home/ubuntu/zephyr-sdk/setup.sh -c
             echo "SDK installation complete."
         else
             echo "SDK already exists."
@@ -239,37 +459,94 @@ class MultipassVM:
         # Verify SDK exists
         res = self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'test', '-d', '/home/ubuntu/zephyr-sdk'], check=False)
         if res.returncode != 0:
+            self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'rm', '-f', '/tmp/sdk.tar.xz'], check=False)
             print("FATAL: Zephyr SDK installation failed - directory not found.")
             raise RuntimeError("Zephyr SDK installation failed")
 
-        # 3. Install uv and setup venv
+        # Populate the host cache from a fresh download, then drop the VM copy
+        res = self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'test', '-f', '/tmp/sdk.tar.xz'], check=False)
+        if res.returncode == 0:
+            if not host_cache.exists():
+                print(f"Caching Zephyr SDK tarball at {host_cache}...")
+                host_cache.parent.mkdir(parents=True, exist_ok=True)
+                tmp_cache = host_cache.with_suffix('.part')
+                res = self._run_cmd(['multipass', 'transfer', f"{self.vm_name}:/tmp/sdk.tar.xz", str(tmp_cache)], check=False)
+                if res.returncode == 0:
+                    os.replace(tmp_cache, host_cache)
+                else:
+                    print("Warning: Could not cache Zephyr SDK tarball on host.")
+            self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'rm', '-f', '/tmp/sdk.tar.xz'], check=False)
+
+    def _sdk_cache_path(self, sdk_version):
+        """Host-side cache location of the SDK tarball for this version and arch."""
+        import platform
+        machine = platform.machine().lower()
+        arch = 'aarch64' if machine in ('arm64', 'aarch64') else 'x86_64'
+        return Path.home() / '.cache' / 'multipass-zephyr' / 'sdk' / f"{sdk_version}-{arch}.tar.xz"
+
+    def _stage_uv_venv(self):
         print("Installing uv and setting up virtual environment...")
-        self.exec_shell("curl -LsSf https://astral.sh/uv/install.sh | sh")
-        self.exec_shell("export PATH=$PATH:$HOME/.local/bin && uv venv /home/ubuntu/.venv")
-        
-        # 4. Install west into venv
+        self.exec_shell("curl -LsSf https://astral.sh/uv/install.sh | sh && uv venv /home/ubuntu/.venv")
+
+    def _stage_west_env(self):
+        # Register the SDK CMake package (requires cmake from the apt stage)
+        self.exec_shell("/home/ubuntu/zephyr-sdk/setup.sh -c")
+
+        # Install west into venv
         self.exec_shell("uv pip install west")
 
-        # 4. Set persistent environment variables (best effort for interactive sessions)
-        env_cmds = [
-            "echo 'export ZEPHYR_TOOLCHAIN_VARIANT=zephyr' >> /home/ubuntu/.bashrc",
-            "echo 'export ZEPHYR_SDK_INSTALL_DIR=/home/ubuntu/zephyr-sdk' >> /home/ubuntu/.bashrc",
-            "echo 'export PATH=$PATH:$HOME/.local/bin' >> /home/ubuntu/.bashrc",
-            "ccache --max-size=5G",
-            "ccache --set-config=cache_dir=/home/ubuntu/.ccache"
-        ]
-        for cmd in env_cmds:
-            self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'bash', '-c', cmd])
+        # Set persistent environment variables (best effort for interactive sessions)
+        bootstrap = (
+            "cat >> /home/ubuntu/.bashrc <<'EOF'\n"
+            "export ZEPHYR_TOOLCHAIN_VARIANT=zephyr\n"
+            "export ZEPHYR_SDK_INSTALL_DIR=/home/ubuntu/zephyr-sdk\n"
+            "export PATH=$PATH:$HOME/.local/bin\n"
+            "EOF\n"
+            "ccache --max-size=5G\n"
+            "ccache --set-config=cache_dir=/home/ubuntu/.ccache\n"
+        )
+        self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'bash', '-c', bootstrap])
+
+    def bootstrap_fingerprint(self, zephyr_base, vm_zephyr_base):
+        """Hash of the host inputs that the bootstrap_script() steps depend on."""
+        import hashlib
+        h = hashlib.sha256(vm_zephyr_base.encode())
+        inputs = sorted(Path(zephyr_base, 'scripts').glob('requirements*.txt')) + [Path(zephyr_base, 'west.yml')]
+        for path in inputs:
+            h.update(path.name.encode() + b'\0')
+            try:
+                h.update(path.read_bytes())
+            except OSError:
+                pass
+        return h.hexdigest()
+
+    def bootstrap_script(self, vm_workspace, vm_zephyr_base, fingerprint):
+        """Shell script running zephyr-export and the Python dependency install
+        unless already done for fingerprint, for combining into a larger run_script().
+
+        The steps are chained explicitly rather than relying on set -e, which
+        bash ignores inside if/else and && lists: a failing step exits the
+        script before the stamp is written.
+        """
+        return f'''
+            if [ "$(cat {self.BOOTSTRAP_STAMP} 2>/dev/null)" = {fingerprint} ]; then
+                echo "Zephyr requirements unchanged, skipping export and Python dependency install."
+            else
+                echo "Exporting Zephyr to CMake package registry in VM..."
+                {self._zephyr_export_cmd(vm_workspace, vm_zephyr_base)} &&
+                echo "Installing Python dependencies (using uv)..." &&
+                ( {self._freeze_reqs(self._req_files(vm_zephyr_base))} ) &&
+                echo {fingerprint} > {self.BOOTSTRAP_STAMP} || exit 1
+            fi
+        '''
 
-    def zephyr_export(self, vm_workspace, vm_zephyr_base):
-        print("Exporting Zephyr to CMake package registry in VM...")
-        self.exec_shell(f"export ZEPHYR_BASE={vm_zephyr_base} && cd {vm_workspace} && west zephyr-export")
+    def _zephyr_export_cmd(self, vm_workspace, vm_zephyr_base):
+        return f"( export ZEPHYR_BASE={vm_zephyr_base} && cd {vm_workspace} && west zephyr-export )"
 
-    def west_packages_pip_install(self, vm_workspace, vm_zephyr_base):
-        print("Installing Python dependencies (using uv)...")
+    def _req_files(self, vm_zephyr_base):
         # Use uv for all requirement files found in zephyr
         # This is significantly faster than west packages pip
-        req_files = [
+        return [
             f"{vm_zephyr_base}/scripts/requirements.txt",
             f"{vm_zephyr_base}/scripts/requirements-base.txt",
             f"{vm_zephyr_base}/scripts/requirements-build-test.txt",
@@ -277,88 +554,423 @@ class MultipassVM:
             f"{vm_zephyr_base}/scripts/requirements-extras.txt",
             f"{vm_zephyr_base}/scripts/requirements-compliance.txt"
         ]
-        
-        # Build one big install command for uv
+
+    def _freeze_reqs(self, req_files):
+        """Shell command list resolving req_files (+ pyelftools) once into a lock file and installing it.
+
+        Lock files are keyed by the requirements' content and live on the
+        host-backed lock cache, so they survive VM recreation. The lock is
+        installed rather than synced, so packages the user added to the venv
+        (extra west extensions, debug tools) are kept.
+        """
         req_args = " ".join([f"-r {f}" for f in req_files])
-        self.exec_shell(f"uv pip install {req_args} pyelftools")
+        return f"""
+        echo pyelftools > /tmp/zephyr-extra-reqs.txt &&
+        KEY=$(cat {' '.join(req_files)} /tmp/zephyr-extra-reqs.txt 2>/dev/null | sha256sum | cut -c1-16) &&
+        LOCK={self.LOCK_CACHE_DIR}/zephyr-constraints-$KEY.txt &&
+        {{ [ -f $LOCK ] || {{
+            uv pip compile --quiet {req_args} -r /tmp/zephyr-extra-reqs.txt -o $LOCK.tmp &&
+            mv $LOCK.tmp $LOCK
+        }}; }} &&
+        uv pip install --quiet -r $LOCK
+        """
 
     def mount(self, host_path, vm_path):
+        source = os.fspath(Path(host_path).expanduser().resolve())
+        # Already verified (or made) by this process. Not seeded from
+        # 'multipass info': the daemon still lists sshfs mounts that went stale.
+        if self._known_mounts.get(vm_path) == source:
+            return
         print(f"Mounting {host_path} to {vm_path}...")
-        # Ensure vm_path exists (as root/sudo)
-        self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'sudo', 'mkdir', '-p', vm_path])
-        
-        # Check if already mounted
-        result = self._run_cmd(['multipass', 'info', self.vm_name, '--format', 'json'])
-        info = json.loads(result.stdout).get('info', {}).get(self.vm_name, {})
-        mounts = info.get('mounts', {})
+        # Ensure vm_path exists; only fall back to sudo outside the user's home so
+        # parents such as /home/ubuntu/.cache stay owned by ubuntu
+        q = shlex.quote(vm_path)
+        probe = f"{{ mkdir -p {q} 2>/dev/null || sudo mkdir -p {q}; }} && mountpoint -q {q}"
+        is_mountpoint = self._run_cmd(['multipass', 'exec', self.vm_name, '--', 'bash', '-c', probe], check=False).returncode == 0
+
+        # Nothing mounted there: mount directly without inspecting 'multipass info'
+        if not is_mountpoint:
+            res = self._run_cmd(['multipass', 'mount', host_path, f"{self.vm_name}:{vm_path}"], check=False)
+            if res.returncode == 0:
+                self._known_mounts[vm_path] = source
+                return
+
+        # Something is (or multipass thinks something is) mounted: verify the source
+        mounts = self._get_info().get('mounts', {})
         if vm_path in mounts:
-            if mounts[vm_path]['source_path'] == str(Path(host_path).expanduser().resolve()):
+            if is_mountpoint and mounts[vm_path]['source_path'] == source:
+                self._known_mounts[vm_path] = source
                 return
-            else:
-                self._run_cmd(['multipass', 'unmount', f"{self.vm_name}:{vm_path}"])
+            self._run_cmd(['multipass', 'unmount', f"{self.vm_name}:{vm_path}"])
 
         self._run_cmd(['multipass', 'mount', host_path, f"{self.vm_name}:{vm_path}"])
+        self._known_mounts[vm_path] = source
 
-    def exec_shell(self, cmd, stream=True, check=True):
-        env = self._get_env_setup()
-        full_cmd = f"{env} && {cmd}"
-        multipass_cmd = ['multipass', 'exec', self.vm_name, '--', 'bash', '-c', full_cmd]
+    def mount_all(self, mounts):
+        """Mount {host_path: vm_path} pairs concurrently; each mount is an independent daemon RPC."""
+        if len(mounts) < 2:
+            for host_path, vm_path in mounts.items():
+                self.mount(host_path, vm_path)
+            return
+        with ThreadPoolExecutor(max_workers=min(4, len(mounts))) as pool:
+            # list() re-raises the first failed mount
+            list(pool.map(lambda pair: self.mount(*pair), mounts.items()))
+
+    def exec_shell(self, cmd, stream=True, check=True, replace=False, shell_needed=None):
+        if shell_needed is None:
+            shell_needed = self._needs_shell(cmd)
+        if shell_needed:
+            env = self._get_env_setup()
+            full_cmd = f"{env} && {cmd}"
+            multipass_cmd = ['multipass', 'exec', self.vm_name, '--', 'bash', '-c', full_cmd]
+        else:
+            # Plain command: skip the bash wrapper and set the environment via env
+            multipass_cmd = ['multipass', 'exec', self.vm_name, '--'] + self._get_env_argv() + shlex.split(cmd)
+        return self._exec(multipass_cmd, stream, check, replace)
+
+    def run_script(self, script, stream=True, check=True):
+        """Run a multi-line bash script in the VM in one round trip (bash -s over stdin)."""
+        # Braces make bash read the whole script before running any of it, so
+        # commands reading stdin get /dev/null rather than the script text
+        script = f"{self._get_env_setup()}\n{{\n{script}\n}} < /dev/null\n"
+        multipass_cmd = ['multipass', 'exec', self.vm_name, '--', 'bash', '-s']
         if stream:
+            return subprocess.run(multipass_cmd, input=script, text=True).returncode
+        result = self._run_cmd(multipass_cmd, input=script, check=check)
+        return result.stdout if check else result
+
+    def exec_argv(self, argv, cwd=None, env=None, stream=True, check=True, replace=False):
+        """Run argv in the VM without a shell, optionally from cwd with extra env variables."""
+        env_args = [f"{key}={value}" for key, value in (env or {}).items()]
+        multipass_cmd = ['multipass', 'exec', self.vm_name]
+        if cwd:
+            multipass_cmd += ['--working-directory', cwd]
+        multipass_cmd += ['--'] + self._get_env_argv() + env_args + list(argv)
+        return self._exec(multipass_cmd, stream, check, replace)
+
+    def _exec(self, multipass_cmd, stream, check, replace):
+        if stream:
+            # Terminal call: hand the process over to multipass (POSIX hosts only,
+            # Windows exec* does not keep the console attached)
+            if replace and os.name != 'nt':
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.execvp(multipass_cmd[0], multipass_cmd)
             return subprocess.run(multipass_cmd).returncode
         else:
             result = self._run_cmd(multipass_cmd, check=check)
             return result.stdout if check else result
 
-    def pull_file(self, vm_path, host_path):
-        print(f"Transferring {vm_path} from VM to {host_path}...")
-        # Ensure host directory exists
-        host_dir = os.path.dirname(os.path.abspath(host_path))
+    def pull_files(self, vm_paths, host_dir):
+        """Transfer several VM files into host_dir with a single multipass transfer."""
+        print(f"Transferring {len(vm_paths)} file(s) from VM to {host_dir}...")
         os.makedirs(host_dir, exist_ok=True)
-        
-        # Multipass transfer syntax: <vm_name>:<vm_path> <host_path>
-        self._run_cmd(['multipass', 'transfer', f"{self.vm_name}:{vm_path}", host_path])
+        sources = [f"{self.vm_name}:{vm_path}" for vm_path in vm_paths]
+        self._run_cmd(['multipass', 'transfer'] + sources + [host_dir])
+
+    def pull_dir(self, vm_path, host_path, workspace_root=None):
+        """Replace host_path with a copy of the VM directory vm_path.
 
-    def delete_dir(self, vm_path):
+        The copy lands in a temporary sibling directory first and is only
+        swapped in once the transfer succeeded, so a failed pull leaves the
+        previous host_path alone. host_path may not be workspace_root or one
+        of its ancestors.
+        """
+        import shutil
+        import tempfile
+        host_path = os.path.abspath(host_path)
+        if workspace_root is not None:
+            root = os.path.realpath(workspace_root)
+            real = os.path.realpath(host_path)
+            if real == root or root.startswith(real.rstrip(os.sep) + os.sep):
+                log.die(f"Refusing to replace {host_path}: it contains the workspace {workspace_root}")
+        print(f"Transferring {vm_path} from VM to {host_path}...")
+        host_parent = os.path.dirname(host_path)
+        os.makedirs(host_parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f".{os.path.basename(host_path)}.pull-", dir=host_parent)
+        try:
+            # Like scp -r, the directory is copied into the destination directory
+            self._run_cmd(['multipass', 'transfer', '--recursive', f"{self.vm_name}:{vm_path}", tmp])
+            old = None
+            if os.path.lexists(host_path):
+                old = tmp + '.old'
+                os.rename(host_path, old)
+            try:
+                os.rename(os.path.join(tmp, posixpath.basename(vm_path.rstrip('/'))), host_path)
+            except OSError:
+                if old:
+                    os.rename(old, host_path)
+                raise
+            if old:
+                shutil.rmtree(old, ignore_errors=True)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def delete_dir(self, vm_path, keep=False):
+        """Delete vm_path in the VM, leaving an empty directory behind if keep is set."""
         print(f"Deleting directory {vm_path} in VM...")
-        self.exec_shell(f"rm -rf {vm_path}")
+        self.exec_shell(self.delete_dir_script(vm_path, keep))
+
+    def delete_dir_script(self, vm_path, keep=False):
+        """Shell script form of delete_dir().
+
+        The tree is renamed aside (O(1) on the same filesystem) and removed in
+        the background, so large build trees do not block the caller. Trash
+        left behind by an interrupted earlier removal is swept up as well.
+        """
+        q = shlex.quote(vm_path)
+        script = f'''
+            if [ -e {q} ]; then
+                T=$(mktemp -u {q}.trash.XXXXXX)
+                mv {q} "$T"
+            fi
+            for t in {q}.trash.*; do
+                [ -e "$t" ] && {{ setsid nohup rm -rf {q}.trash.* >/dev/null 2>&1 </dev/null & }}
+                break
+            done
+        '''
+        if keep:
+            script += f"mkdir -p {q}\n"
+        return script
+
+    def sync_to_local(self, vm_mount_path, vm_local_path, excludes=None):
+        """Rsync from mount to local storage inside VM; returns the exit code.
 
-    def sync_to_local(self, vm_mount_path, vm_local_path):
-        """Rsync from mount to local storage inside VM."""
+        excludes defaults to RSYNC_EXCLUDES.
+        """
+        excludes = excludes or self.RSYNC_EXCLUDES
         print(f"Syncing {vm_mount_path} to {vm_local_path}...")
-        # Ensure target directory exists
-        self.exec_shell(f"mkdir -p {vm_local_path}")
-        # Anchored rsync with common ignores (leading slash means root-relative)
+        # Ensure target directory and filter rules exist. A cold copy into an
+        # empty target is a plain tar pipe (no per-file comparison to do);
+        # otherwise an in-place rsync (leading slash in the rules means
+        # root-relative). Both ends are local to the VM, so changed files are
+        # copied whole rather than delta-checksummed on both sides.
+        filters, filters_script = self._rsync_filters_script(excludes)
         sync_cmd = f'''
-            rsync -a --delete \
-                --exclude='/.git/' \
-                --exclude='/build/' \
-                --exclude='/builds/' \
-                --exclude='/twister-out*/' \
-                --exclude='__pycache__/' \
-                --exclude='*.pyc' \
-                --exclude='*.o' \
-                --exclude='/.cache/' \
+            set -e -o pipefail
+            mkdir -p {vm_local_path}
+            {filters_script}
+            if [ -z "$(ls -A {vm_local_path})" ]; then
+                tar -C {vm_mount_path} {self._tar_excludes(excludes)} -cf - . | tar -C {vm_local_path} -xpf -
+            else
+                rsync -a --delete --inplace --numeric-ids \
+                    --filter='merge {filters}' \
+                    {vm_mount_path}/ {vm_local_path}/
+            fi
+        '''
+        return self.exec_shell(sync_cmd)
+
+    def _tar_excludes(self, excludes):
+        """Rsync-style excludes as GNU tar --exclude options for an archive of '.'."""
+        options = []
+        for pattern in excludes:
+            if pattern.startswith('/'):
+                pattern = './' + pattern[1:]
+            options.append(shlex.quote(f"--exclude={pattern.rstrip('/')}"))
+        return ' '.join(options)
+
+    def sync_excludes(self, workspace_root):
+        """RSYNC_EXCLUDES plus the host directories that pulls from the VM wrote into workspace_root.
+
+        Pulled build artifacts must neither count as workspace changes nor be
+        copied back over the VM's own build tree.
+        """
+        extra = []
+        for path in self.load_state().get('pulled_dirs', []):
+            rel = os.path.relpath(path, workspace_root)
+            if rel != os.curdir and not rel.startswith(os.pardir):
+                extra.append(f"/{Path(rel).as_posix()}/")
+        return self.RSYNC_EXCLUDES + tuple(sorted(extra))
+
+    def record_pulled_dir(self, host_path):
+        """Remember host_path as a pull destination, see sync_excludes()."""
+        host_path = os.path.realpath(host_path)
+        pulled = self.load_state().get('pulled_dirs', [])
+        if host_path not in pulled:
+            self.update_state(pulled_dirs=pulled + [host_path])
+
+    def state_dir(self):
+        """Host directory for this VM's persistent state (build history, vsync)."""
+        return Path.home() / '.cache' / 'multipass-zephyr' / self.vm_name
+
+    def load_state(self):
+        try:
+            with open(self.state_dir() / 'state.json', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def update_state(self, **values):
+        state = self.load_state()
+        state.update(values)
+        state_file = self.state_dir() / 'state.json'
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = state_file.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, state_file)
+        return state
+
+    def _watcher_started(self, workspace_root):
+        """Start time of a live 'west vsync' watcher on workspace_root, or None."""
+        state_dir = self.state_dir()
+        try:
+            with open(state_dir / 'vsync.json', 'r') as f:
+                state = json.load(f)
+            heartbeat = (state_dir / 'heartbeat').stat().st_mtime
+        except (OSError, ValueError):
+            return None
+        if state.get('root') != workspace_root or time.time() - heartbeat > self.VSYNC_HEARTBEAT_TIMEOUT:
+            return None
+        return state.get('started')
+
+    def sync_workspace(self, workspace_root, vm_mount_path, vm_local_path):
+        """Sync the workspace to local storage, as a delta when 'west vsync' is tracking changes."""
+        state_dir = self.state_dir()
+        dirty_list = state_dir / 'dirty.list'
+        synced_file = state_dir / 'synced.json'
+        started = self._watcher_started(workspace_root)
+
+        try:
+            with open(synced_file, 'r') as f:
+                synced = json.load(f)
+        except (OSError, ValueError):
+            synced = {}
+        same_target = synced.get('root') == workspace_root and synced.get('dest') == vm_local_path
+        excludes = self.sync_excludes(workspace_root)
+
+        fingerprint = None
+        if started is not None:
+            # Deltas are only valid on top of a full sync made while the watcher ran
+            if same_target and synced.get('ts', 0) >= started:
+                if self.sync_delta(dirty_list, vm_mount_path, vm_local_path, excludes):
+                    return
+                print("Delta sync failed, falling back to a full sync...")
+        else:
+            # No watcher: a local walk of the host tree is far cheaper than
+            # rsync walking it over the mount, so skip the sync if nothing changed
+            fingerprint = self.tree_fingerprint(workspace_root, excludes)
+            if same_target and synced.get('fingerprint') == fingerprint:
+                print("Workspace unchanged since last sync.")
+                return
+
+        sync_start = time.time()
+        if started is not None:
+            # Everything recorded so far is covered by the full sync below
+            dirty_list.unlink(missing_ok=True)
+        synced_file.unlink(missing_ok=True)
+        # Only a complete copy may be recorded: deltas and the unchanged-tree
+        # check both build on it
+        rc = self.sync_to_local(vm_mount_path, vm_local_path, excludes)
+        if rc != 0:
+            log.die(f"Syncing the workspace into the VM failed with return code {rc}")
+        state_dir.mkdir(parents=True, exist_ok=True)
+        with open(synced_file, 'w') as f:
+            json.dump({'root': workspace_root, 'dest': vm_local_path, 'ts': sync_start,
+                       'fingerprint': fingerprint}, f)
+
+    def tree_fingerprint(self, root, excludes=None):
+        """Hash of the type, size and mtime of every path under root that a sync copies.
+
+        excludes defaults to RSYNC_EXCLUDES.
+        """
+        import fnmatch
+        import re
+        from hashlib import blake2b
+
+        # One regex per (anchored?, directory?) combination of excludes; anchored
+        # patterns match the root-relative path, the others the entry name
+        def compile_excludes(anchored, is_dir):
+            patterns = [fnmatch.translate(p.strip('/')) for p in excludes or self.RSYNC_EXCLUDES
+                        if p.startswith('/') == anchored and (is_dir or not p.endswith('/'))]
+            return re.compile('|'.join(patterns) or '(?!)')
+        excluded = {(anchored, is_dir): compile_excludes(anchored, is_dir)
+                    for anchored in (True, False) for is_dir in (True, False)}
+
+        h = blake2b()
+        pending = ['']
+        while pending:
+            rel_dir = pending.pop()
+            try:
+                entries = sorted(os.scandir(os.path.join(root, rel_dir)), key=lambda e: e.name)
+            except OSError:
+                continue
+            for entry in entries:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if excluded[(True, is_dir)].match(rel) or excluded[(False, is_dir)].match(entry.name):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                h.update(f"{rel}\0{st.st_mode}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+                if is_dir:
+                    pending.append(rel)
+        return h.hexdigest()
+
+    def sync_delta(self, dirty_list_path, vm_mount_path, vm_local_path, excludes=None):
+        """Sync only the paths recorded in dirty_list_path; returns False if a full sync is needed.
+
+        excludes defaults to RSYNC_EXCLUDES; excluded paths are neither copied nor removed.
+        """
+        excludes = excludes or self.RSYNC_EXCLUDES
+        pending = Path(f"{dirty_list_path}.{os.getpid()}")
+        try:
+            os.replace(dirty_list_path, pending)
+        except FileNotFoundError:
+            print("No workspace changes since last sync.")
+            return True
+
+        paths = sorted(set(p for p in pending.read_bytes().split(b'\0')
+                           if p and not _is_excluded(os.fsdecode(p), excludes)))
+        if not paths:
+            pending.unlink()
+            return True
+
+        print(f"Syncing {len(paths)} changed path(s) from {vm_mount_path} to {vm_local_path}...")
+        # Paths that still exist are rsynced, vanished ones are removed from the local copy
+        filters, filters_script = self._rsync_filters_script(excludes)
+        script = f'''
+            set -e
+            [ -d {vm_local_path} ] || exit 3
+            {filters_script}
+            cd {vm_mount_path}
+            # Per-run list: concurrent syncs into the same VM must not share it
+            F=$(mktemp)
+            trap 'rm -f "$F"' EXIT
+            while IFS= read -r -d '' f; do
+                if [ -e "$f" ]; then printf '%s\\0' "$f" >> "$F"; else rm -rf "{vm_local_path}/$f"; fi
+            done
+            rsync -a -r --from0 --files-from="$F" \
+                --filter='merge {filters}' \
                 {vm_mount_path}/ {vm_local_path}/
         '''
-        self.exec_shell(sync_cmd)
+        res = subprocess.run(['multipass', 'exec', self.vm_name, '--', 'bash', '-c', script],
+                             input=b'\0'.join(paths) + b'\0')
+        pending.unlink()
+        return res.returncode == 0
+
+    def _rsync_filters_script(self, excludes):
+        """Return (path, shell snippet) for a file of rsync exclude rules.
+
+        The file name is keyed by the rules, so a changed exclude list gets a
+        fresh file instead of reusing stale rules; the snippet writes it once.
+        """
+        import hashlib
+        rules = "\n".join(f"- {pattern}" for pattern in excludes)
+        path = f"{self.RSYNC_FILTERS}-{hashlib.sha256(rules.encode()).hexdigest()[:16]}"
+        script = (f"[ -f {path} ] || {{ mkdir -p $(dirname {path}) && "
+                  f"cat > {path}.$$ <<'EOF' && mv {path}.$$ {path}; }}\n{rules}\nEOF")
+        return path, script
         
     def setup_native_sim_network(self):
         """Set up TAP networking for native_sim if not already configured."""
         print("Setting up TAP network interface for native_sim...")
         
-        # Check if zeth interface already exists
-        check_cmd = "ip link show zeth 2>/dev/null"
-        # We use stream=False and check=False to capture the return code without raising an error
-        result = self.exec_shell(check_cmd, stream=False, check=False)
-        
-        # If result is a CompletedProcess object (from _run_cmd via exec_shell(stream=False))
-        if hasattr(result, 'returncode') and result.returncode == 0:
+        # Reuse the dependency probe's answer when ensure_vm already ran it
+        if self._has_zeth is None:
+            self._has_zeth = self._zeth_exists()
+        if self._has_zeth:
             print("TAP interface 'zeth' already configured.")
             return
-        # Handle string return (stdout) if check was True or returncode wasn't available
-        elif isinstance(result, str) and "zeth" in result:
-             print("TAP interface 'zeth' already configured.")
-             return
 
         # Run net-setup.sh from tools/net-tools
         # Note: We assume the workspace is already synced to /home/ubuntu/src
@@ -369,8 +981,90 @@ class MultipassVM:
         rc = self.exec_shell(setup_cmd)
         if rc != 0:
             log.wrn("Network setup failed. Networking samples may not work correctly.")
-        else:
-            print("TAP interface configured successfully.")
+            return
+
+        # Poll with backoff until the interface shows up instead of assuming success
+        for delay in (0.01, 0.02, 0.05, 0.1, 0.25, 0.5):
+            if self._zeth_exists():
+                self._has_zeth = True
+                print("TAP interface configured successfully.")
+                return
+            time.sleep(delay)
+        log.wrn("TAP interface 'zeth' did not appear. Networking samples may not work correctly.")
 
-    def is_multipass_installed(self):
+    def _zeth_exists(self):
+        return self.exec_shell("ip link show zeth", stream=False, check=False).returncode == 0
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def is_multipass_installed():
+        # Cannot change within one process
+        import shutil
         return shutil.which('multipass') is not None
+
+
+def _is_excluded(rel_path, excludes):
+    """Apply rsync-style excludes (see MultipassVM.sync_excludes) to a workspace-relative POSIX path."""
+    import fnmatch
+    parts = rel_path.split('/')
+    for pattern in excludes:
+        anchored = pattern.startswith('/')
+        pattern = pattern.strip('/')
+        if anchored:
+            # Compare against as many leading components as the pattern has
+            if fnmatch.fnmatch('/'.join(parts[:pattern.count('/') + 1]), pattern):
+                return True
+        elif any(fnmatch.fnmatch(part, pattern) for part in parts):
+            return True
+    return False
+
+
+def _pid_alive(pid):
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _deferred_scale_down(vm_name, delay, token):
+    vm = MultipassVM(vm_name)
+    while True:
+        state = vm.load_state()
+        # Superseded by a newer schedule, or cancelled by a command that
+        # handled scaling itself
+        if state.get('scale_down_token') != token:
+            return
+        if vm.in_use():
+            time.sleep(min(delay, 30))
+            continue
+        remaining = state.get('last_activity_ts', 0) + delay - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+            continue
+        vm.ensure_resources('low')
+        vm.update_state(scale_down_token=None)
+        return
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--scale-down']:
+        _deferred_scale_down(sys.argv[2], float(sys.argv[3]), sys.argv[4])
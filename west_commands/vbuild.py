@@ -1,14 +1,22 @@
 import argparse
-import subprocess
 import os
 import sys
-from pathlib import Path
+import time
+from concurrent.futures import ThreadPoolExecutor
 from west.commands import WestCommand
 from west import log
 
-# Add current directory to sys.path to allow importing multipass_vm
-sys.path.append(os.path.dirname(__file__))
-from multipass_vm import MultipassVM
+# Add current directory to sys.path to allow importing multipass_vm and _paths
+# (west loads each command file standalone, so the package __init__ never runs)
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.append(os.path.dirname(__file__))
+from _paths import _arg_paths, _build_hash, _plan_vm_paths, _resolve, _rewrite_arg_paths, _topdir, find_source_dir
+
+# Resource scaling heuristics
+WARM_WINDOW = 120            # seconds after a build during which the VM counts as warm
+SHORT_BUILD_SECS = 30        # build-duration EMA below which scale-down is deferred
+IDLE_SCALE_DOWN_SECS = 300   # idle time before a deferred scale-down
+EMA_ALPHA = 0.3
 
 
 class VBuild(WestCommand):
@@ -40,6 +48,9 @@ class VBuild(WestCommand):
         return parser
 
     def do_run(self, args, unknown_args):
+        # Imported here so loading the command (e.g. for --help) stays light
+        from multipass_vm import MultipassVM
+
         vm = MultipassVM(args.vm_name)
         if not vm.is_multipass_installed():
             log.die("Multipass is not installed. Please install it from https://multipass.run/")
@@ -48,123 +59,112 @@ class VBuild(WestCommand):
         if '--net' in unknown_args:
             log.die("The --net flag is supported by 'west vrun', not 'west vbuild'. Did you mean to use 'west vrun' instead?")
 
-        # Dynamic Resource Scaling: Scale UP
-        vm.ensure_resources('high')
-        
-        try:
-            self._do_run_internal(vm, args, unknown_args)
-        finally:
-            if not args.keep_warm:
-                vm.ensure_resources('low')
+        # Dynamic Resource Scaling: Scale UP, unless a build just finished and
+        # left the VM scaled up (avoids a stop/reconfigure/start cycle per build)
+        state = vm.load_state()
+        recent = time.time() - state.get('last_build_end_ts', 0) < WARM_WINDOW
+        warm = recent and vm.has_resources('high')
 
-    def _do_run_internal(self, vm, args, unknown_args):
+        with vm.activity():
+            build_start = time.time()
+            # Scale up in the background while host-side paths are resolved
+            pool = ThreadPoolExecutor(max_workers=1)
+            try:
+                scale_up = None if warm else pool.submit(vm.ensure_resources, 'high')
+                self._do_run_internal(vm, args, unknown_args, scale_up)
+            finally:
+                pool.shutdown()
+                build_end = time.time()
+                duration = build_end - build_start
+                ema = state.get('build_ema')
+                ema = duration if ema is None else EMA_ALPHA * duration + (1 - EMA_ALPHA) * ema
+                vm.update_state(last_build_end_ts=build_end, build_ema=ema)
+
+                if args.keep_warm:
+                    vm.cancel_scale_down()
+                elif ema < SHORT_BUILD_SECS:
+                    # Short builds tend to come in bursts: scale down once idle instead of now
+                    vm.schedule_scale_down(IDLE_SCALE_DOWN_SECS)
+                else:
+                    vm.cancel_scale_down()
+                    vm.ensure_resources('low')
+
+    def _do_run_internal(self, vm, args, unknown_args, scale_up=None):
         # Determine paths
         zephyr_base = os.environ.get('ZEPHYR_BASE')
         if not zephyr_base:
             log.die("ZEPHYR_BASE environment variable is not set. Please run 'source zephyr-env.sh' or equivalent.")
         
-        zephyr_base = str(Path(zephyr_base).resolve())
+        zephyr_base = _resolve(zephyr_base)
 
         # Find workspace root
-        from west.util import west_topdir, WestNotFound
-        try:
-            workspace_root = west_topdir(os.getcwd())
-        except WestNotFound:
-            workspace_root = os.path.dirname(zephyr_base) # fallback
-        
-        workspace_root = str(Path(workspace_root).resolve())
+        workspace_root = _topdir(os.getcwd(), zephyr_base)
 
-        # Pass target resources if they were set by ensure_resources
-        target_cpus = getattr(vm, 'target_cpus', None)
-        target_mem = getattr(vm, 'target_memory', None)
-        vm.ensure_vm(zephyr_base, cpus=target_cpus, memory=target_mem)
-
-        # Determine source and build dirs
-        source_dir = args.source_dir
-        remainder = []
-        source_dir_found = False
-        for arg in unknown_args:
-            if not source_dir_found and not arg.startswith('-'):
-                # Check relative to CWD
-                if os.path.isdir(arg):
-                    source_dir = arg
-                    source_dir_found = True
-                    continue
-                
-                # Check relative to workspace root
-                ws_rel_path = os.path.join(workspace_root, arg)
-                if os.path.isdir(ws_rel_path):
-                    source_dir = ws_rel_path
-                    source_dir_found = True
-                    continue
-            
-            remainder.append(arg)
+        # Determine source and build dirs: a directory among the args
+        # (relative to CWD, then to the workspace root) wins over -s
+        found, remainder = find_source_dir(unknown_args, ('', workspace_root))
+        source_dir = found or args.source_dir
         
         if not source_dir:
             source_dir = os.getcwd()
 
-        source_dir = str(Path(source_dir).resolve())
+        source_dir = _resolve(source_dir)
         
-        # Build dir resolution
-        build_dir = args.build_dir or os.path.join(source_dir, 'build')
-        build_dir = str(Path(build_dir).resolve())
-
         # VM Mount points
         vm_workspace = '/mnt/workspace_vbuild'
-        
-        # Mounting the entire workspace
-        vm.mount(workspace_root, vm_workspace)
-        
-        # Path remapping logic
-        def get_vm_path(host_path):
-            try:
-                rel = Path(host_path).relative_to(workspace_root)
-                return str(Path(vm_workspace) / rel)
-            except ValueError:
-                import hashlib
-                h = hashlib.md5(host_path.encode()).hexdigest()[:8]
-                vm_path = f"/mnt/ext_{h}"
-                vm.mount(host_path, vm_path)
-                return vm_path
-
-        vm_source_dir = get_vm_path(source_dir)
-        vm_zephyr_base = get_vm_path(zephyr_base)
-
-        # Performance optimization: Sync to local storage
+        vm_local_root = "/home/ubuntu/src"
+
+        # Performance optimization: build from local storage unless --no-sync
+        vm_root = vm_workspace if args.no_sync else vm_local_root
+
+        # Remap every host path up front: sources, a user -d build dir and
+        # absolute paths in the remaining args go under vm_root (the local
+        # copy unless --no-sync). Paths outside the workspace get /mnt/ext_<hash> mounts.
+        # Resolved like the workspace root (and vrun's -d) so the prefix test holds
+        host_build_dir = _resolve(args.build_dir) if args.build_dir else None
+        host_paths = [source_dir, zephyr_base] + ([host_build_dir] if host_build_dir else []) + _arg_paths(remainder)
+        vm_paths, ext_mounts = _plan_vm_paths(host_paths, workspace_root, vm_root)
+
+        # Host-side work is done: wait for the scale-up before touching the VM
+        if scale_up is not None:
+            scale_up.result()
+
+        # Pass target resources if they were set by ensure_resources
+        target_cpus = getattr(vm, 'target_cpus', None)
+        target_mem = getattr(vm, 'target_memory', None)
+        vm.ensure_vm(zephyr_base, cpus=target_cpus, memory=target_mem)
+
+        # Mount the entire workspace and any external roots concurrently
+        vm.mount_all({workspace_root: vm_workspace, **ext_mounts})
+
         if not args.no_sync:
-            vm_local_root = "/home/ubuntu/src"
-            vm.sync_to_local(vm_workspace, vm_local_root)
-            
-            # Remap paths to local storage
-            def get_local_path(host_path):
-                rel = Path(host_path).relative_to(workspace_root)
-                return str(Path(vm_local_root) / rel)
-            
-            vm_source_dir = get_local_path(source_dir)
-            vm_zephyr_base = get_local_path(zephyr_base)
-            # Re-update the VM workspace root for command execution
-            vm_workspace = vm_local_root
+            vm.sync_workspace(workspace_root, vm_workspace, vm_local_root)
+
+        vm_source_dir = vm_paths[source_dir]
+        vm_zephyr_base = vm_paths[zephyr_base]
+        remainder = _rewrite_arg_paths(remainder, vm_paths)
+        # VM workspace root for command execution
+        vm_workspace = vm_root
 
         # Build dir resolution
         # Default to an internal VM path to avoid mount permission issues
-        import hashlib
-        h = hashlib.md5(source_dir.encode()).hexdigest()[:8]
+        h = _build_hash(source_dir)
         vm_build_dir = f"/home/ubuntu/builds/{h}"
         
         # If user provided -d, we use it relative to workspace or as absolute
         if args.build_dir:
-            vm_build_dir = get_vm_path(os.path.abspath(args.build_dir))
+            vm_build_dir = vm_paths[host_build_dir]
         
-        # Ensure internal build dir exists
+        # In-VM preparation as one script: ensure the internal build dir
+        # exists, then (suggested by user) run zephyr-export and install
+        # python packages after mount, skipped while requirements are unchanged
+        prep = ['set -e']
         if args.pristine:
-            vm.delete_dir(vm_build_dir)
-        vm.exec_shell(f"mkdir -p {vm_build_dir}")
-
-        # Suggested by user: run zephyr-export after mount
-        vm.zephyr_export(vm_workspace, vm_zephyr_base)
-        
-        # Suggested by user: install python packages after mount
-        vm.west_packages_pip_install(vm_workspace, vm_zephyr_base)
+            prep.append(vm.delete_dir_script(vm_build_dir))
+        prep.append(f"mkdir -p {vm_build_dir}")
+        prep.append(vm.bootstrap_script(vm_workspace, vm_zephyr_base, vm.bootstrap_fingerprint(zephyr_base, vm_zephyr_base)))
+        if vm.run_script('\n'.join(prep)) != 0:
+            log.die("Failed to prepare the VM for the build")
 
         # Thread maximization: Get VM CPUS
         vm_cpus, _ = vm.get_current_resources()
@@ -185,32 +185,41 @@ class VBuild(WestCommand):
 
         log.inf(f"Running build in VM '{args.vm_name}'...")
         
-        # Execute from workspace root in VM
+        # Execute from workspace root in VM, attached to the terminal
+        # (e.g. '-t menuconfig')
         # Enable ccache natively as per plan
-        env_setup = f"export ZEPHYR_BASE={vm_zephyr_base} && export CCACHE=1"
-        full_command = f"cd {vm_workspace} && {env_setup} && {' '.join(west_cmd)}"
-        
-        rc = vm.exec_shell(full_command)
+        env = {'ZEPHYR_BASE': vm_zephyr_base, 'CCACHE': '1'}
+        rc = vm.exec_argv(west_cmd, cwd=vm_workspace, env=env)
         if rc != 0:
             log.die(f"Build failed with return code {rc}")
         
         log.inf("Build completed successfully.")
 
-        if args.pull:
+        if args.pull and vm_build_dir.startswith('/mnt/'):
+            # --no-sync or an external -d: the build wrote through a host mount
+            log.inf("Build directory is on a host mount, nothing to pull.")
+        elif args.pull:
             log.inf("Pulling artifacts to host...")
-            # Files to pull
+            # Files to pull (all under zephyr/)
             artifacts = [
                 'zephyr/zephyr.elf',
                 'zephyr/zephyr.exe',
                 'zephyr/zephyr.bin',
                 'zephyr/zephyr.map',
             ]
-            for art in artifacts:
-                vm_art_path = f"{vm_build_dir}/{art}"
-                host_art_path = os.path.join(build_dir, art)
-                
-                # Check if file exists in VM before pulling
-                check_cmd = f"multipass exec {vm.vm_name} -- test -f {vm_art_path}"
-                res = subprocess.run(check_cmd, shell=True, capture_output=True)
-                if res.returncode == 0:
-                    vm.pull_file(vm_art_path, host_art_path)
+            # Check which artifacts exist in one exec, then transfer them together
+            check_cmd = f"cd {vm_build_dir} && for f in {' '.join(artifacts)}; do [ -f $f ] && echo $f; done; true"
+            existing = vm.exec_shell(check_cmd, stream=False).split()
+            if existing:
+                # Host build dir is only needed here
+                build_dir = host_build_dir or os.path.join(source_dir, 'build')
+                host_zephyr_dir = os.path.join(build_dir, 'zephyr')
+                # Keep the pulled artifacts out of later workspace syncs
+                vm.record_pulled_dir(build_dir)
+                vm.pull_files([f"{vm_build_dir}/{art}" for art in existing], host_zephyr_dir)
+                # multipass transfer drops the executable bit
+                if os.name != 'nt':
+                    for art in existing:
+                        if art.endswith(('.elf', '.exe')):
+                            host_art = os.path.join(host_zephyr_dir, os.path.basename(art))
+                            os.chmod(host_art, os.stat(host_art).st_mode | 0o111)
@@ -1,13 +1,14 @@
 import argparse
 import os
 import sys
-from pathlib import Path
 from west.commands import WestCommand
 from west import log
 
-# Add current directory to sys.path to allow importing multipass_vm
-sys.path.append(os.path.dirname(__file__))
-from multipass_vm import MultipassVM
+# Add current directory to sys.path to allow importing multipass_vm and _paths
+# (west loads each command file standalone, so the package __init__ never runs)
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.append(os.path.dirname(__file__))
+from _paths import _build_hash, _resolve
 
 
 class VClean(WestCommand):
@@ -34,10 +35,18 @@ class VClean(WestCommand):
         return parser
 
     def do_run(self, args, unknown_args):
+        # Imported here so loading the command (e.g. for --help) stays light
+        from multipass_vm import MultipassVM
+
         vm = MultipassVM(args.vm_name)
         if not vm.is_multipass_installed():
             log.die("Multipass is not installed.")
 
+        # Registered as VM activity so a pending deferred scale-down waits for it
+        with vm.activity():
+            self._do_run_internal(vm, args, unknown_args)
+
+    def _do_run_internal(self, vm, args, unknown_args):
         status = vm.get_status()
         if status == 'not-found':
             log.inf(f"VM '{args.vm_name}' does not exist. Nothing to clean.")
@@ -45,7 +54,7 @@ class VClean(WestCommand):
 
         if args.all:
             log.inf("Cleaning ALL builds in VM...")
-            vm.delete_dir("/home/ubuntu/builds/*")
+            vm.delete_dir("/home/ubuntu/builds", keep=True)
             log.inf("Done.")
             return
 
@@ -54,10 +63,9 @@ class VClean(WestCommand):
         if not source_dir:
             source_dir = os.getcwd()
         
-        source_dir = str(Path(source_dir).resolve())
+        source_dir = _resolve(source_dir)
         
-        import hashlib
-        h = hashlib.md5(source_dir.encode()).hexdigest()[:8]
+        h = _build_hash(source_dir)
         vm_build_dir = f"/home/ubuntu/builds/{h}"
         
         log.inf(f"Cleaning build for {source_dir} (VM path: {vm_build_dir})...")
@@ -1,13 +1,15 @@
 import argparse
 import os
-from pathlib import Path
+import shlex
 import sys
 from west.commands import WestCommand
 from west import log
 
-# Add current directory to sys.path to allow importing multipass_vm
-sys.path.append(os.path.dirname(__file__))
-from multipass_vm import MultipassVM
+# Add current directory to sys.path to allow importing multipass_vm and _paths
+# (west loads each command file standalone, so the package __init__ never runs)
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.append(os.path.dirname(__file__))
+from _paths import _build_hash, _plan_vm_paths, _resolve, _topdir, find_source_dir
 
 
 class VRun(WestCommand):
@@ -44,10 +46,18 @@ class VRun(WestCommand):
         return False
 
     def do_run(self, args, unknown_args):
+        # Imported here so loading the command (e.g. for --help) stays light
+        from multipass_vm import MultipassVM
+
         vm = MultipassVM(args.vm_name)
         if not vm.is_multipass_installed():
             log.die("Multipass is not installed.")
 
+        # Registered as VM activity so a pending deferred scale-down waits for it
+        with vm.activity():
+            self._do_run_internal(vm, args, unknown_args)
+
+    def _do_run_internal(self, vm, args, unknown_args):
         vm.ensure_vm()
 
         # Determine workspace root
@@ -55,51 +65,38 @@ class VRun(WestCommand):
         if not zephyr_base:
             log.die("ZEPHYR_BASE not set.")
         
-        zephyr_base = str(Path(zephyr_base).resolve())
-        from west.util import west_topdir, WestNotFound
-        try:
-            workspace_root = west_topdir(os.getcwd())
-        except WestNotFound:
-            workspace_root = os.path.dirname(zephyr_base)
-        workspace_root = str(Path(workspace_root).resolve())
+        zephyr_base = _resolve(zephyr_base)
+        workspace_root = _topdir(os.getcwd(), zephyr_base)
 
         # Determine source dir (needed for hashing if build_dir not provided)
         source_dir = args.source_dir_pos
-        remainder = []
-        source_dir_found = False
-        for arg in unknown_args:
-            if not source_dir and not source_dir_found and not arg.startswith('-') and os.path.isdir(arg):
-                source_dir = arg
-                source_dir_found = True
-            else:
-                remainder.append(arg)
+        remainder = unknown_args
+        if not source_dir:
+            source_dir, remainder = find_source_dir(unknown_args)
 
         if not source_dir:
             source_dir = os.getcwd()
         
-        source_dir = str(Path(source_dir).resolve())
+        source_dir = _resolve(source_dir)
 
         # Build dir resolution
         if args.build_dir:
-            # Use provided build dir
-            host_build_dir = str(Path(args.build_dir).resolve())
-            try:
-                rel = Path(host_build_dir).relative_to(workspace_root)
-                vm_build_dir = str(Path('/mnt/workspace_vbuild') / rel)
-            except ValueError:
-                import hashlib
-                h = hashlib.md5(host_build_dir.encode()).hexdigest()[:8]
-                vm_build_dir = f"/mnt/ext_{h}"
-                vm.mount(host_build_dir, vm_build_dir)
+            # Same mapping as vbuild's -d: in the VM's local copy of the
+            # workspace (or on the mount with --no-sync), or on its own mount
+            host_build_dir = _resolve(args.build_dir)
+            local_paths, build_mounts = _plan_vm_paths([host_build_dir], workspace_root, '/home/ubuntu/src')
+            mount_paths, _ = _plan_vm_paths([host_build_dir], workspace_root, '/mnt/workspace_vbuild')
+            vm.mount_all(build_mounts)
+            vm_build_dirs = dict.fromkeys([local_paths[host_build_dir], mount_paths[host_build_dir]])
         else:
             # Use hashed internal path (same as vbuild)
-            import hashlib
-            h = hashlib.md5(source_dir.encode()).hexdigest()[:8]
-            vm_build_dir = f"/home/ubuntu/builds/{h}"
+            h = _build_hash(source_dir)
+            vm_build_dirs = [f"/home/ubuntu/builds/{h}"]
             
         # Execute
         # Check for zephyr.exe first (modern native_sim), then zephyr.elf
-        find_exe = f"if [ -f {vm_build_dir}/zephyr/zephyr.exe ]; then echo {vm_build_dir}/zephyr/zephyr.exe; else echo {vm_build_dir}/zephyr/zephyr.elf; fi"
+        candidates = ' '.join(f"{d}/zephyr/zephyr.exe {d}/zephyr/zephyr.elf" for d in vm_build_dirs)
+        find_exe = f"for f in {candidates}; do [ -f $f ] && echo $f && break; done; true"
         exe = vm._run_cmd(['multipass', 'exec', vm.vm_name, '--', 'bash', '-c', find_exe], check=False).stdout.strip()
         
         if not exe:
@@ -120,6 +117,7 @@ class VRun(WestCommand):
 
         log.inf(f"Running {exe} in VM '{args.vm_name}'...")
         
-        full_command = f"chmod +x {exe} && {exe} {' '.join(remainder)}"
-        rc = vm.exec_shell(full_command)
+        # Build outputs are already executable; only chmod when the bit is missing
+        q = shlex.quote(exe)
+        rc = vm.exec_shell(f"[ -x {q} ] || chmod +x {q}; exec {shlex.join([exe] + remainder)}", replace=True)
         sys.exit(rc)
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from west.commands import WestCommand
+from west import log
+
+# Add current directory to sys.path to allow importing multipass_vm and _paths
+# (west loads each command file standalone, so the package __init__ never runs)
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.append(os.path.dirname(__file__))
+from _paths import _resolve, _topdir
+
+
+class VSync(WestCommand):
+    def __init__(self):
+        super().__init__(
+            'vsync',
+            'Track workspace changes for fast Multipass VM syncs.',
+            'Watches the workspace and records changed paths so that "west vbuild" '
+            'and "west vtwister" only rsync what changed. Requires the watchdog package.',
+            accepts_unknown_args=False
+        )
+
+    def do_add_parser(self, parser_adder):
+        parser = parser_adder.add_parser(
+            self.name,
+            help=self.help,
+            description=self.description,
+            formatter_class=argparse.RawDescriptionHelpFormatter
+        )
+
+        parser.add_argument('--vm-name', default='zephyr-vm', help='Name of the Multipass VM to track changes for')
+
+        return parser
+
+    def do_run(self, args, unknown_args):
+        # Imported here so loading the command (e.g. for --help) stays light
+        from multipass_vm import MultipassVM, _is_excluded
+
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            log.die("'west vsync' requires the watchdog package. Install it with 'pip install watchdog'.")
+
+        zephyr_base = os.environ.get('ZEPHYR_BASE')
+        if not zephyr_base:
+            log.die("ZEPHYR_BASE environment variable is not set. Please run 'source zephyr-env.sh' or equivalent.")
+
+        zephyr_base = _resolve(zephyr_base)
+        workspace_root = _topdir(os.getcwd(), zephyr_base)
+
+        vm = MultipassVM(args.vm_name)
+        excludes = vm.sync_excludes(workspace_root)
+        state_dir = vm.state_dir()
+        state_dir.mkdir(parents=True, exist_ok=True)
+        dirty_list = state_dir / 'dirty.list'
+        heartbeat = state_dir / 'heartbeat'
+        lock = threading.Lock()
+
+        class DirtyPathRecorder(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Directory mtime changes are implied by the file events inside them
+                if event.is_directory and event.event_type == 'modified':
+                    return
+                paths = [event.src_path, getattr(event, 'dest_path', '')]
+                records = []
+                for path in paths:
+                    if not path:
+                        continue
+                    try:
+                        rel = Path(path).relative_to(workspace_root).as_posix()
+                    except ValueError:
+                        continue
+                    if rel != '.' and not _is_excluded(rel, excludes):
+                        records.append(rel.encode() + b'\0')
+                if records:
+                    # Reopen per event: consumers rename the list away to claim it
+                    with lock, open(dirty_list, 'ab') as f:
+                        f.write(b''.join(records))
+
+        observer = Observer()
+        observer.schedule(DirtyPathRecorder(), workspace_root, recursive=True)
+        observer.start()
+
+        heartbeat.touch()
+        with open(state_dir / 'vsync.json', 'w') as f:
+            json.dump({'root': workspace_root, 'started': time.time(), 'pid': os.getpid()}, f)
+
+        log.inf(f"Watching {workspace_root} for VM '{args.vm_name}'. Press Ctrl-C to stop.")
+        try:
+            while observer.is_alive():
+                heartbeat.touch()
+                time.sleep(MultipassVM.VSYNC_HEARTBEAT_TIMEOUT / 4)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            observer.stop()
+            observer.join()
+            (state_dir / 'vsync.json').unlink(missing_ok=True)
+            log.inf("Stopped watching.")
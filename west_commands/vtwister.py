@@ -1,15 +1,24 @@
 import argparse
 import subprocess
 import os
+import posixpath
+import re
+import shlex
 import sys
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from west.commands import WestCommand
 from west import log
 
-# Add current directory to sys.path to allow importing multipass_vm
-sys.path.append(os.path.dirname(__file__))
-from multipass_vm import MultipassVM
+# Add current directory to sys.path to allow importing multipass_vm and _paths
+# (west loads each command file standalone, so the package __init__ never runs)
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.append(os.path.dirname(__file__))
+from _paths import _arg_paths, _plan_vm_paths, _resolve, _rewrite_arg_paths, _topdir
+
+# --jobs, --jobs=N, -j and -jN (but not e.g. --jobs-foo)
+JOBS_ARG = re.compile(r'^(--jobs(=|$)|-j(\d|$))')
 
 
 class VTwister(WestCommand):
@@ -34,87 +43,77 @@ class VTwister(WestCommand):
         parser.add_argument('--pull-results', action='store_true', help='Pull twister-out directory from VM to host after run')
         parser.add_argument('-O', '--outdir', help='Output directory for twister results')
         parser.add_argument('--keep-warm', action='store_true', help='Do not scale down VM resources after run')
+        parser.add_argument('--jobs-scale', type=float, default=1.25, help='Twister jobs per VM CPU when --jobs is not given (capped at 2.0, default: 1.25)')
 
         return parser
 
     def do_run(self, args, unknown_args):
+        # Imported here so loading the command (e.g. for --help) stays light
+        from multipass_vm import MultipassVM
+
         vm = MultipassVM(args.vm_name)
         if not vm.is_multipass_installed():
             log.die("Multipass is not installed. Please install it from https://multipass.run/")
 
-        # Dynamic Resource Scaling: Scale UP
-        vm.ensure_resources('high')
-        
-        try:
-            self._do_run_internal(vm, args, unknown_args)
-        finally:
-            if not args.keep_warm:
-                vm.ensure_resources('low')
-
-    def _do_run_internal(self, vm, args, unknown_args):
+        # Dynamic Resource Scaling: Scale UP, in the background while
+        # host-side paths are resolved
+        with vm.activity():
+            pool = ThreadPoolExecutor(max_workers=1)
+            try:
+                scale_up = pool.submit(vm.ensure_resources, 'high')
+                self._do_run_internal(vm, args, unknown_args, scale_up)
+            finally:
+                pool.shutdown()
+                # This run decides the scaling now; drop any pending deferred scale-down
+                vm.cancel_scale_down()
+                if not args.keep_warm:
+                    vm.ensure_resources('low')
+
+    def _do_run_internal(self, vm, args, unknown_args, scale_up=None):
         # Determine paths
         zephyr_base = os.environ.get('ZEPHYR_BASE')
         if not zephyr_base:
             log.die("ZEPHYR_BASE environment variable is not set. Please run 'source zephyr-env.sh' or equivalent.")
         
-        zephyr_base = str(Path(zephyr_base).resolve())
+        zephyr_base = _resolve(zephyr_base)
 
         # Find workspace root
-        from west.util import west_topdir, WestNotFound
-        try:
-            workspace_root = west_topdir(os.getcwd())
-        except WestNotFound:
-            workspace_root = os.path.dirname(zephyr_base) # fallback
-        
-        workspace_root = str(Path(workspace_root).resolve())
+        workspace_root = _topdir(os.getcwd(), zephyr_base)
+
+        # VM Mount points
+        vm_workspace = '/mnt/workspace_vbuild'
+        vm_local_root = "/home/ubuntu/src"
+
+        # Performance optimization: run from local storage unless --no-sync (default True)
+        vm_root = vm_workspace if args.no_sync else vm_local_root
+
+        # Remap every host path up front (ZEPHYR_BASE, an absolute -O and any
+        # absolute paths in the twister args); external paths get one mount each
+        host_outdir_abs = args.outdir if args.outdir and os.path.isabs(args.outdir) else None
+        host_paths = [zephyr_base] + ([host_outdir_abs] if host_outdir_abs else []) + _arg_paths(unknown_args)
+        vm_paths, ext_mounts = _plan_vm_paths(host_paths, workspace_root, vm_root)
+
+        # Host-side work is done: wait for the scale-up before touching the VM
+        if scale_up is not None:
+            scale_up.result()
 
         # Pass target resources if they were set by ensure_resources
         target_cpus = getattr(vm, 'target_cpus', None)
         target_mem = getattr(vm, 'target_memory', None)
         vm.ensure_vm(zephyr_base, cpus=target_cpus, memory=target_mem)
 
-        # VM Mount points
-        vm_workspace = '/mnt/workspace_vbuild'
-        
-        # Mounting the entire workspace
-        vm.mount(workspace_root, vm_workspace)
-        
-        # Path remapping logic
-        def get_vm_path(host_path):
-            try:
-                rel = Path(host_path).relative_to(workspace_root)
-                return str(Path(vm_workspace) / rel)
-            except ValueError:
-                import hashlib
-                h = hashlib.md5(host_path.encode()).hexdigest()[:8]
-                vm_path = f"/mnt/ext_{h}"
-                vm.mount(host_path, vm_path)
-                return vm_path
-
-        vm_zephyr_base = get_vm_path(zephyr_base)
-
-        # Performance optimization: Sync to local storage (default True)
+        # Mount the entire workspace and any external roots concurrently
+        for host_path in ext_mounts:
+            os.makedirs(host_path, exist_ok=True)
+        vm.mount_all({workspace_root: vm_workspace, **ext_mounts})
+
         if not args.no_sync:
-            vm_local_root = "/home/ubuntu/src"
-            vm.sync_to_local(vm_workspace, vm_local_root)
-            
-            # Remap paths to local storage
-            def get_local_path(host_path):
-                rel = Path(host_path).relative_to(workspace_root)
-                return str(Path(vm_local_root) / rel)
-            
-            vm_zephyr_base = get_local_path(zephyr_base)
-            # Re-update the VM workspace root for command execution
-            vm_workspace = vm_local_root
+            vm.sync_workspace(workspace_root, vm_workspace, vm_local_root)
 
-        # Execute from workspace root in VM
-        env_setup = vm._get_env_setup() # Use central env setup
-        
-        # Suggested by user: run zephyr-export after mount/sync
-        vm.zephyr_export(vm_workspace, vm_zephyr_base)
-        
-        # Suggested by user: install python packages after mount/sync
-        vm.west_packages_pip_install(vm_workspace, vm_zephyr_base)
+        vm_zephyr_base = vm_paths[zephyr_base]
+        unknown_args = _rewrite_arg_paths(unknown_args, vm_paths)
+        # VM workspace root for command execution
+        vm_workspace = vm_root
 
         # Thread maximization: Get VM CPUS
         vm_cpus, _ = vm.get_current_resources()
@@ -125,12 +124,10 @@ class VTwister(WestCommand):
         # If user provided -O / --outdir, we use it
         vm_outdir = "twister-out"
         if args.outdir:
-            if os.path.isabs(args.outdir):
-                vm_outdir = get_vm_path(args.outdir)
-                if not args.no_sync:
-                    vm_outdir = get_local_path(args.outdir)
+            if host_outdir_abs:
+                vm_outdir = vm_paths[host_outdir_abs]
             else:
-                vm_outdir = args.outdir
+                vm_outdir = Path(args.outdir).as_posix()
             
             twister_cmd.extend(['-O', vm_outdir])
 
@@ -138,41 +135,48 @@ class VTwister(WestCommand):
         if vm_cpus:
             # Twister uses --jobs
             # Check if user already provided --jobs / -j
-            has_jobs = False
-            for u_arg in unknown_args:
-                if u_arg == '--jobs' or u_arg == '-j' or u_arg.startswith('--jobs=') or u_arg.startswith('-j'):
-                    has_jobs = True
-                    break
-            
+            has_jobs = any(map(JOBS_ARG.match, unknown_args))
             if not has_jobs:
-                twister_cmd.extend(['--jobs', str(vm_cpus)])
+                # Oversubscribe a little to cover compiler I/O waits, never past 2x
+                jobs_scale = min(max(args.jobs_scale, 0), 2.0)
+                twister_cmd.extend(['--jobs', str(max(1, int(vm_cpus * jobs_scale)))])
 
         twister_cmd.extend(unknown_args)
 
         log.inf(f"Running twister in VM '{args.vm_name}'...")
         
-        # Note:Twister needs a larger environment setup, but _get_env_setup should cover it
-        full_command = f"cd {vm_workspace} && export ZEPHYR_BASE={vm_zephyr_base} && {env_setup} && {' '.join(twister_cmd)}"
-        
-        rc = vm.exec_shell(full_command)
+        # One VM round trip: (suggested by user) run zephyr-export and install
+        # python packages after mount/sync, skipped while the requirements are
+        # unchanged, then run twister from the workspace root. run_script
+        # applies the central env setup.
+        script = '\n'.join([
+            'set -e',
+            vm.bootstrap_script(vm_workspace, vm_zephyr_base, vm.bootstrap_fingerprint(zephyr_base, vm_zephyr_base)),
+            f"cd {shlex.quote(vm_workspace)}",
+            f"export ZEPHYR_BASE={shlex.quote(vm_zephyr_base)}",
+            shlex.join(twister_cmd),
+        ])
+        rc = vm.run_script(script)
         
         if args.pull_results:
-            log.inf(f"Pulling results from {vm_outdir} to host...")
-            
-            vm_abs_outdir = vm_outdir
-            if not os.path.isabs(vm_outdir):
-                vm_abs_outdir = os.path.join(vm_workspace, vm_outdir)
-            
-            if not args.no_sync:
-                # Sync back to mount first
-                vm_mount_workspace = '/mnt/workspace_vbuild'
-                print(f"Syncing results back to mount...")
-                # Ensure the target directory exists in mount
-                vm.exec_shell(f"mkdir -p {vm_mount_workspace}/{vm_outdir}")
-                sync_back_cmd = f"rsync -a --delete {vm_abs_outdir}/ {vm_mount_workspace}/{vm_outdir}/"
-                vm.exec_shell(sync_back_cmd)
-            
-            host_outdir = args.outdir or os.path.join(os.getcwd(), 'twister-out')
+            # VM paths are POSIX whatever the host is; an absolute vm_outdir wins
+            vm_abs_outdir = posixpath.join(vm_workspace, vm_outdir)
+
+            # Relative outdirs are relative to the workspace root twister ran from
+            host_outdir = host_outdir_abs or os.path.join(workspace_root, args.outdir or 'twister-out')
+
+            # With --no-sync, or an outdir outside the workspace, twister wrote
+            # straight through a host mount and there is nothing to pull
+            results_on_mount = args.no_sync or vm_abs_outdir.startswith('/mnt/')
+            if results_on_mount:
+                log.inf("Results already on host mount, nothing to pull.")
+            else:
+                # Pulled over multipass's own transfer channel rather than
+                # rsynced onto sshfs
+                log.inf(f"Pulling results from {vm_outdir} to host...")
+                vm.record_pulled_dir(host_outdir)
+                vm.pull_dir(vm_abs_outdir, host_outdir, workspace_root)
+
             log.inf(f"Results available on host at: {host_outdir}")
 
         if rc != 0: